@@ -1,6 +1,6 @@
 import streamlit as st
-import pandas as pd
-import random
+import numpy as np
+import csv
 from io import StringIO
 
 # --- Configuration and Constants ---
@@ -8,28 +8,45 @@ POINTS_PER_PUMP = 5
 TOTAL_TRIALS = 7
 
 
-MAX_PUMPS_MAP = {
-    'Yellow': 8,
-    'Orange': 16,   
-    'Blue': 64     
-}
+@st.cache_resource
+def _constants():
+    """Builds the lookup tables once per process; they are shared by every session."""
+    # Balloon colors and their max pumps, indexed in parallel
+    colors = ('Yellow', 'Orange', 'Blue')
+    max_pumps = np.array([8, 16, 64], dtype=np.int16)
+    # Shared across sessions, so guard against accidental in-place edits
+    max_pumps.setflags(write=False)
+
+    departments = (
+        'Select Department',
+        'Accounting', 
+        'Finance (BAF)', 
+        'Management Studies (MGT)', 
+        'Entrepreneurship',
+        'Marketing',
+        'Economics',
+        'Other'
+    )
+
+    # Column order of the exported trial data
+    required_cols = (
+        'participant_name', 'department', 'game_id', 
+        'trial_number', 'balloon_color', 'pumps', 
+        'exploded', 'money_earned', 'total_money_after_trial'
+    )
+    return colors, max_pumps, departments, required_cols
 
-DEPARTMENTS = [
-    'Select Department',
-    'Accounting', 
-    'Finance (BAF)', 
-    'Management Studies (MGT)', 
-    'Entrepreneurship',
-    'Marketing',
-    'Economics',
-    'Other'
-]
+COLORS, MAX_PUMPS, DEPARTMENTS, REQUIRED_COLS = _constants()
 
 # --- Session State Initialization ---
 if 'page' not in st.session_state:
     st.session_state['page'] = 'start'
-if 'trial_data' not in st.session_state:
-    st.session_state['trial_data'] = []
+if 'pumps_arr' not in st.session_state:
+    # Per-trial outcomes, one slot per trial (participant fields are stored once)
+    st.session_state['pumps_arr'] = np.zeros(TOTAL_TRIALS, dtype=np.int8)
+    st.session_state['exploded_arr'] = np.zeros(TOTAL_TRIALS, dtype=np.bool_)
+    st.session_state['money_earned_arr'] = np.zeros(TOTAL_TRIALS, dtype=np.int32)
+    st.session_state['total_after_arr'] = np.zeros(TOTAL_TRIALS, dtype=np.int32)
 if 'total_score' not in st.session_state:
     st.session_state['total_score'] = 0
 if 'current_trial' not in st.session_state:
@@ -38,115 +55,101 @@ if 'temp_score' not in st.session_state:
     st.session_state['temp_score'] = 0
 if 'pumps' not in st.session_state:
     st.session_state['pumps'] = 0
-if 'balloon_colors_sequence' not in st.session_state:
-    # Initialize the randomized sequence of colors for 7 trials
-    colors = list(MAX_PUMPS_MAP.keys())
-    sequence = random.choices(colors, k=TOTAL_TRIALS)
-    st.session_state['balloon_colors_sequence'] = sequence
-if 'max_pumps_this_trial' not in st.session_state: # Renamed from 'max_pumps'
-    st.session_state['max_pumps_this_trial'] = 0
+if 'color_idx' not in st.session_state:
+    rng = np.random.default_rng()
+    # Initialize the randomized sequence of colors for 7 trials (as indexes into COLORS)
+    color_idx = rng.integers(0, len(COLORS), size=TOTAL_TRIALS, dtype=np.int8)
+    st.session_state['color_idx'] = color_idx
+    max_pumps_arr = MAX_PUMPS[color_idx]
+    # Pre-determine the pump each balloon pops on. Pump k+1 bursts with
+    # chance 1 / (max_pumps - k) and is certain at max_pumps, so the first
+    # draw under its threshold is the popping pump.
+    draws = rng.random((TOTAL_TRIALS, int(MAX_PUMPS.max())))
+    remaining = max_pumps_arr[:, None] - np.arange(draws.shape[1])
+    probs = 1.0 / np.maximum(remaining, 1)
+    st.session_state['pop_at_arr'] = (np.argmax(draws < probs, axis=1) + 1).astype(np.int16)
 
 # --- Helper Functions ---
 
-def setup_new_trial():
-    """Sets the max pumps for the current trial based on color sequence."""
-    if st.session_state['current_trial'] <= TOTAL_TRIALS:
-        current_color = st.session_state['balloon_colors_sequence'][st.session_state['current_trial'] - 1]
-        st.session_state['max_pumps_this_trial'] = MAX_PUMPS_MAP[current_color]
-
 def next_trial():
     """Records the outcome and prepares state for the next balloon/trial."""
-    current_color = st.session_state['balloon_colors_sequence'][st.session_state['current_trial'] - 1]
+    ss = st.session_state
+    current_trial = ss.current_trial
+    t = current_trial - 1
     
-   
-    is_exploded = 0
-    if st.session_state['page'] == 'explosion':
-        is_exploded = 1
-    elif st.session_state['page'] == 'game_over_explosion':
-        is_exploded = 1
-
-    st.session_state['trial_data'].append({
-        'participant_name': st.session_state['participant_name'],
-        'department': st.session_state['department'],
-        'game_id': st.session_state['game_id'],
-        'trial_number': st.session_state['current_trial'],
-        'balloon_color': current_color,
-        'pumps': st.session_state['pumps'],
-        'exploded': is_exploded, 
-        'money_earned': st.session_state['temp_score'] if is_exploded == 0 else 0, # 0 if exploded
-        'total_money_after_trial': st.session_state['total_score']
-    })
+    is_exploded = ss.page == 'explosion'
+
+    ss.pumps_arr[t] = ss.pumps
+    ss.exploded_arr[t] = is_exploded
+    ss.money_earned_arr[t] = 0 if is_exploded else ss.temp_score # 0 if exploded
+    ss.total_after_arr[t] = ss.total_score
     
     # 2. Increment trial counter
-    st.session_state['current_trial'] += 1
+    current_trial += 1
+    ss.current_trial = current_trial
     
     # 3. Reset temporary variables
-    st.session_state['temp_score'] = 0
-    st.session_state['pumps'] = 0
+    ss.temp_score = 0
+    ss.pumps = 0
     
     # 4. Check if game is over
-    if st.session_state['current_trial'] > TOTAL_TRIALS:
-        st.session_state['page'] = 'end'
+    if current_trial > TOTAL_TRIALS:
+        ss.page = 'end'
     else:
-        # 5. Setup for the new trial
-        setup_new_trial()
-        st.session_state['page'] = 'game'
+        ss.page = 'game'
 
 def handle_pump():
     """Handles the 'Pump' button click and explosion check."""
+    ss = st.session_state
     
-    # Ensure setup is run if not already done (e.g., first pump of a new trial)
-    if st.session_state['max_pumps_this_trial'] == 0:
-        setup_new_trial()
-
-    max_pumps = st.session_state['max_pumps_this_trial']
-    
-    st.session_state['pumps'] += 1
-    current_pumps = st.session_state['pumps']
-    
-    st.session_state['temp_score'] += POINTS_PER_PUMP
+    current_pumps = ss.pumps + 1
+    ss.pumps = current_pumps
+    ss.temp_score += POINTS_PER_PUMP
     
     # --- New Increasing Risk Logic ---
     
-    # If maximum pumps are reached, it explodes instantly
-    if current_pumps >= max_pumps:
-        st.session_state['page'] = 'explosion'
-    else:
-    
-        prob_explosion = 1 / (max_pumps - current_pumps + 1)
-        
-        # Check for explosion based on this increasing random chance
-        if random.random() < prob_explosion:
-            st.session_state['page'] = 'explosion'
+    # The popping pump was drawn at session start (see pop_at_arr)
+    if current_pumps >= ss.pop_at_arr[ss.current_trial - 1]:
+        ss.page = 'explosion'
     
     # Simple growth effect to reflect pumping
-    st.session_state['balloon_size'] = 150 + st.session_state['pumps'] * 5
+    ss.balloon_size = 150 + current_pumps * 5
 
 def handle_collect():
     """Handles the 'Collect' button click and saves the temporary score."""
+    ss = st.session_state
     # Add temporary score to total score
-    st.session_state['total_score'] += st.session_state['temp_score']
+    ss.total_score += ss.temp_score
     # Record data and move to next trial
     next_trial()
 
 def reset_game():
     """Resets the entire session state for a new participant."""
     # Clear all state variables
-    for key in list(st.session_state.keys()):
-        del st.session_state[key]
+    st.session_state.clear()
     # Rerun the app to reinitialize state
     st.rerun() # Replaced st.experimental_rerun()
 
+@st.cache_data(max_entries=64, show_spinner=False)
+def _build_csv(rows: tuple) -> bytes:
+    """Serializes the trial rows (tuples in REQUIRED_COLS order) to CSV bytes (cached)."""
+    buf = StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow(REQUIRED_COLS)
+    writer.writerows(rows)
+    return buf.getvalue().encode('utf-8')
+
 # --- UI Components ---
 
-def balloon_ui(color, pumps):
-    """Displays the balloon graphic with color and size based on pumps."""
+@st.cache_data(max_entries=512, show_spinner=False)
+def _balloon_html(color: str, pumps: int) -> str:
+    """Builds the balloon HTML for a given color and pump count (cached)."""
     # Use HTML/CSS to create a colored circle that grows
     size = 150 + pumps * 5
     # Ensure size doesn't get too ridiculous
     size = min(size, 350)
     
-    html_content = f"""
+    return f"""
     <div style="
         display: flex; 
         flex-direction: column; 
@@ -177,7 +180,10 @@ def balloon_ui(color, pumps):
         "></div>
     </div>
     """
-    st.markdown(html_content, unsafe_allow_html=True)
+
+def balloon_ui(color, pumps):
+    """Displays the balloon graphic with color and size based on pumps."""
+    st.markdown(_balloon_html(color, pumps), unsafe_allow_html=True)
     st.markdown(f"<h3 style='text-align: center;'>Balloon Color: {color}</h3>", unsafe_allow_html=True)
 
 def score_panel_ui():
@@ -225,26 +231,30 @@ def start_page():
                 # Ensure Game ID is safe for filenames
                 st.session_state['game_id'] = game_id.strip().replace(' ', '_') 
                 
-                # Setup the first trial max pumps
-                setup_new_trial()
-                
                 st.session_state['page'] = 'game'
                 st.rerun() # Replaced st.experimental_rerun()
 
-def game_page():
-    """Screen 2: The main BART interface."""
-    current_color = st.session_state['balloon_colors_sequence'][st.session_state['current_trial'] - 1]
+@st.fragment
+def _decision_fragment(current_trial):
+    """Balloon and pump/collect buttons; pump clicks only rerun this fragment."""
+    ss = st.session_state
 
-    st.title(f"Trial {st.session_state['current_trial']} of {TOTAL_TRIALS}")
-    
+    # A finished trial (explosion or collect) needs the whole page redrawn;
+    # main() then dispatches straight to the explosion or end screen
+    if ss.page != 'game' or ss.current_trial != current_trial:
+        st.rerun(scope="app")
+
+    current_color = COLORS[ss.color_idx[current_trial - 1]]
+
+    # The score panel lives here so its metrics update with every pump
     score_panel_ui()
     
     st.markdown("---")
-    
+
     col1, col2 = st.columns([1, 2])
     
     with col1:
-        balloon_ui(current_color, st.session_state['pumps'])
+        balloon_ui(current_color, ss.pumps)
 
     with col2:
         st.subheader("Your Decision")
@@ -262,22 +272,25 @@ def game_page():
         )
         st.markdown("")
         st.button(
-            f"💰 COLLECT (${st.session_state['temp_score']})", 
+            f"💰 COLLECT (${ss.temp_score})", 
             on_click=handle_collect,
             use_container_width=True,
-            disabled=(st.session_state['pumps'] == 0) # Can't collect zero score
+            disabled=(ss.pumps == 0) # Can't collect zero score
         )
-        
-        # Check if an explosion happened immediately after a pump
-        if st.session_state['page'] == 'explosion':
-            # This triggers the transition to the explosion screen.
-            st.session_state['page'] = 'game_over_explosion'
-            st.rerun() # Replaced st.experimental_rerun()
+
+def game_page():
+    """Screen 2: The main BART interface."""
+    ss = st.session_state
+    current_trial = ss.current_trial
+
+    st.title(f"Trial {current_trial} of {TOTAL_TRIALS}")
+
+    _decision_fragment(current_trial)
 
 
 def explosion_page():
     """Displayed immediately after an explosion."""
-    current_color = st.session_state['balloon_colors_sequence'][st.session_state['current_trial'] - 1]
+    current_color = COLORS[st.session_state['color_idx'][st.session_state['current_trial'] - 1]]
     
     st.title("💥 BOOM! Balloon Exploded.")
     
@@ -294,37 +307,45 @@ def explosion_page():
 
 def end_page():
     """Screen 3: End of experiment, display results, and CSV download."""
+    # pandas is only needed for the preview table, so import it lazily
+    import pandas as pd
+    ss = st.session_state
+
     st.title("✅ Experiment Complete")
     st.success("Thank you for participating!")
 
-    final_score = st.session_state['total_score']
+    final_score = ss.total_score
     st.header(f"Final Total Score: ${final_score}")
 
     st.markdown("---")
     st.subheader("Data Summary")
 
-    # Convert recorded data list to a DataFrame
-    df = pd.DataFrame(st.session_state['trial_data'])
-    
-    # Ensure column order matches requirements
-    required_cols = [
-        'participant_name', 'department', 'game_id', 
-        'trial_number', 'balloon_color', 'pumps', 
-        'exploded', 'money_earned', 'total_money_after_trial'
-    ]
-    
-    # Handle cases where columns might be missing (shouldn't happen, but for robustness)
-    df = df.reindex(columns=required_cols)
+    n = ss.current_trial - 1
+
+    # Assemble rows from the per-trial arrays, in REQUIRED_COLS order
+    rows = tuple(zip(
+        (ss.participant_name,) * n,
+        (ss.department,) * n,
+        (ss.game_id,) * n,
+        range(1, n + 1),
+        (COLORS[i] for i in ss.color_idx[:n]),
+        ss.pumps_arr[:n].tolist(),
+        ss.exploded_arr[:n].astype(np.int8).tolist(),
+        ss.money_earned_arr[:n].tolist(),
+        ss.total_after_arr[:n].tolist(),
+    ))
     
+    # The DataFrame is only built for the on-screen preview
+    df = pd.DataFrame(rows, columns=REQUIRED_COLS)
     st.dataframe(df, use_container_width=True)
 
-    # Prepare CSV file for download
-    csv_filename = f"BART_{st.session_state['game_id']}.csv"
-    csv_string = df.to_csv(index=False)
+    # Prepare CSV file for download (cached, so repeat downloads skip serialization)
+    csv_filename = f"BART_{ss.game_id}.csv"
+    csv_bytes = _build_csv(rows)
     
     st.download_button(
         label=f"⬇️ Download Data ({csv_filename})",
-        data=csv_string,
+        data=csv_bytes,
         file_name=csv_filename,
         mime='text/csv',
         type="primary"
@@ -353,9 +374,6 @@ def main():
         game_page()
     elif st.session_state['page'] == 'explosion':
         explosion_page()
-    elif st.session_state['page'] == 'game_over_explosion':
-        
-        explosion_page() 
     elif st.session_state['page'] == 'end':
         end_page()
 